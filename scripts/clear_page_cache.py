@@ -0,0 +1,9 @@
+"""Forgets the cached IDs of journal pages.
+
+Run this after moving or deleting daily or monthly journal pages by hand, so
+that they are searched for again rather than written to at their old IDs.
+"""
+from voice_notes.notion import page_cache
+
+if __name__ == "__main__":
+    page_cache.clear()
@@ -6,30 +6,42 @@ import os
 
 logging.basicConfig(stream=sys.stdout, level=logging.INFO)
 
-from tqdm import tqdm
 from voice_notes import VoiceNote, INGRESS_PATH, global_config
+from voice_notes.voice_note import VoiceNoteStatus, synchronize_batch
+from voice_notes.util.cache import list_ingress_mp3s
+
+MAX_WORKERS = 8
 
 
 if __name__ == "__main__":
-    # sort here so that we get notes in the order they were created when they get
-    # added to Notion
-    with global_config.db() as db:
-        existing_item_names = set(dict(db).keys())
-    for_import = sorted(list(INGRESS_PATH.glob("*.mp3")), key=lambda p: p.stem)
+    existing_items = global_config.all_items()
+    existing_item_names = {item.name for item in existing_items}
 
     logging.info("Checking for new items...")
-    for item in tqdm(for_import):
+    new_notes = []
+    for item in list_ingress_mp3s(INGRESS_PATH):
         if item.name in existing_item_names:
             warnings.warn(f"Skipping existing item {item}")
             os.remove(str(item.absolute()))
             continue
 
-        vnote = VoiceNote(item)
-        vnote.safe_synchronize(global_config)
+        new_notes.append(VoiceNote(item))
 
-    logging.info("Checking to see if previously imported need processing...")
-    with global_config.db() as db:
-        items = sorted(list(dict(db).values()), key=lambda item: item.name)
+    # Previously imported items may need further processing if they failed
+    # partway, finished items would be no-ops, so don't bother scheduling them
+    unfinished_notes = [
+        item for item in existing_items if item.status < VoiceNoteStatus.Notion
+    ]
+    logging.info(
+        "Found %d new and %d unfinished item(s).",
+        len(new_notes),
+        len(unfinished_notes),
+    )
 
-    for item in tqdm(items):
-        item.safe_synchronize(global_config)
+    # sort here so that we get notes in the order they were created when they get
+    # added to Notion
+    synchronize_batch(
+        sorted(new_notes + unfinished_notes, key=lambda item: item.name),
+        global_config,
+        max_workers=MAX_WORKERS,
+    )
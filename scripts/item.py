@@ -1,7 +1,7 @@
 """Utility script providing item level modification and introspection."""
-import argparse
 from enum import Enum
 from voice_notes import global_config, VoiceNote, Transcript
+from voice_notes.cli import common_parser
 
 
 class ItemAction(str, Enum):
@@ -18,13 +18,7 @@ class ItemAction(str, Enum):
         return self.value
 
 
-parser = argparse.ArgumentParser("Print information about a note")
-parser.add_argument(
-    "--file",
-    type=str,
-    required=True,
-    help="The filename and extension (DB key) for the audio note.",
-)
+parser = common_parser("Print information about a note")
 parser.add_argument(
     "--action",
     type=ItemAction,
@@ -49,8 +43,9 @@ if __name__ == "__main__":
         transcript = Transcript.from_aws_transcribe_json(item.transcript["results"])
         print(transcript.to_string())
     elif args.action == ItemAction.Delete:
-        with global_config.db() as db:
+        with global_config.db_transaction() as db:
             del db[args.file]
+        global_config.invalidate(args.file)
     elif args.action == ItemAction.ResetTranscript:
         item.reset_transcript(global_config)
     elif args.action == ItemAction.Synchronize:
@@ -62,3 +57,5 @@ if __name__ == "__main__":
             )
 
         item.attach_existing_transcript(global_config, args.job)
+
+    global_config.flush()
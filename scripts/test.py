@@ -1,16 +1,10 @@
 """This is just for testing ideas and ensuring methods work interactively."""
-import argparse
 from voice_notes import global_config, VoiceNote
+from voice_notes.cli import common_parser
 
 notion = global_config.notion_client
 
-parser = argparse.ArgumentParser("Attach an existing transcript job.")
-parser.add_argument(
-    "--file",
-    type=str,
-    required=True,
-    help="The filename and extension (DB key) for the audio note.",
-)
+parser = common_parser("Attach an existing transcript job.")
 
 if __name__ == "__main__":
     args = parser.parse_args()
@@ -0,0 +1,19 @@
+"""Shared command line argument parsing for the scripts in `scripts/`."""
+import argparse
+
+__all__ = ["common_parser"]
+
+
+def common_parser(description: str) -> argparse.ArgumentParser:
+    """Create a parser for scripts which operate on a single note via `--file`.
+
+    Scripts add any further arguments they need to the returned parser.
+    """
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument(
+        "--file",
+        type=str,
+        required=True,
+        help="The filename and extension (DB key) for the audio note.",
+    )
+    return parser
@@ -1,101 +1,371 @@
-"""Provide global configuration and API connections."""
+"""Provide global configuration and API connections.
+
+`boto3` and `notion_client` are slow to import, so they are only imported once a
+script actually needs to talk to AWS or Notion.
+"""
+import atexit
+import dbm
 import os
+import pickle
+import sqlite3
+import threading
+from collections.abc import MutableMapping
 from dataclasses import dataclass, field
+from functools import cached_property, wraps
 from pathlib import Path
 from contextlib import contextmanager
 
-import boto3
-import botocore.config
 import shelve
-from typing import Any
-from notion_client import Client
+from typing import Any, ClassVar, Dict
 
-__all__ = ["INGRESS_PATH", "ARCHIVE_PATH", "config", "Config"]
+__all__ = ["INGRESS_PATH", "ARCHIVE_PATH", "config", "Config", "SqliteShelf"]
 
 ROOT_PATH = Path.home() / ".voice-note"
 INGRESS_PATH = ROOT_PATH / "ingress"
-DB_PATH = ROOT_PATH / "archive" / "notes"
+DB_PATH = ROOT_PATH / "archive" / "notes.sqlite"
+LEGACY_DB_PATH = ROOT_PATH / "archive" / "notes"
 SECRETS_PATH = ROOT_PATH / "secrets"
 ARCHIVE_PATH = ROOT_PATH / "archive" / "mp3s"
 
 
+class SqliteShelf(MutableMapping):
+    """A `shelve` lookalike storing pickled values in a sqlite table.
+
+    Unlike `dbm`, sqlite in WAL mode lets other processes read the database while
+    a long running import is writing to it, and listing all values takes a single
+    query rather than a seek per key.
+    """
+
+    def __init__(self, path: str, protocol: int = pickle.HIGHEST_PROTOCOL):
+        self.protocol = protocol
+        self._transaction_depth = 0
+        self._conn = sqlite3.connect(
+            path, check_same_thread=False, isolation_level=None
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS notes (name TEXT PRIMARY KEY, pickle BLOB)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)"
+        )
+
+    def __getitem__(self, key):
+        row = self._conn.execute(
+            "SELECT pickle FROM notes WHERE name = ?", (key,)
+        ).fetchone()
+        if row is None:
+            raise KeyError(key)
+
+        return pickle.loads(row[0])
+
+    def __setitem__(self, key, value):
+        self._conn.execute(
+            "INSERT OR REPLACE INTO notes (name, pickle) VALUES (?, ?)",
+            (key, pickle.dumps(value, protocol=self.protocol)),
+        )
+
+    def __delitem__(self, key):
+        cursor = self._conn.execute("DELETE FROM notes WHERE name = ?", (key,))
+        if cursor.rowcount == 0:
+            raise KeyError(key)
+
+    def __iter__(self):
+        return iter([r[0] for r in self._conn.execute("SELECT name FROM notes")])
+
+    def __len__(self):
+        return self._conn.execute("SELECT COUNT(*) FROM notes").fetchone()[0]
+
+    def values(self):
+        """Stream every value from a single query, unpickling them one at a time."""
+        for (blob,) in self._conn.execute("SELECT pickle FROM notes"):
+            yield pickle.loads(blob)
+
+    def items(self):
+        """Stream every item from a single query, unpickling them one at a time."""
+        for name, blob in self._conn.execute("SELECT name, pickle FROM notes"):
+            yield name, pickle.loads(blob)
+
+    @contextmanager
+    def transaction(self):
+        """Group writes into a single transaction, rolling back on error."""
+        if self._transaction_depth == 0:
+            self._conn.execute("BEGIN")
+
+        self._transaction_depth += 1
+        try:
+            yield self
+        except BaseException:
+            self._transaction_depth -= 1
+            if self._transaction_depth == 0:
+                self._conn.execute("ROLLBACK")
+            raise
+        else:
+            self._transaction_depth -= 1
+            if self._transaction_depth == 0:
+                self._conn.execute("COMMIT")
+
+    def sync(self):
+        """Provided for `shelve` compatibility, writes are committed immediately."""
+
+    def close(self):
+        """Close the underlying connection."""
+        self._conn.close()
+
+    @classmethod
+    def open(cls, path: Path, legacy_path: Path = None):
+        """Open the database at `path`, importing from a legacy `shelve` once.
+
+        The import is recorded in the same transaction as the notes it copies, so
+        an import which fails partway is retried the next time.
+        """
+        shelf = cls(str(path.absolute()))
+        if legacy_path is not None and dbm.whichdb(str(legacy_path)):
+            imported = shelf._conn.execute(
+                "SELECT 1 FROM meta WHERE key = 'legacy_imported'"
+            ).fetchone()
+            if not imported:
+                with shelf.transaction():
+                    # before the marker existed, only an import filled the database
+                    if len(shelf) == 0:
+                        with shelve.open(
+                            str(legacy_path.absolute()), flag="r"
+                        ) as legacy:
+                            for k in legacy:
+                                shelf[k] = legacy[k]
+
+                    shelf._conn.execute(
+                        "INSERT INTO meta (key, value) VALUES ('legacy_imported', '1')"
+                    )
+
+        return shelf
+
+
+def _client_property(f):
+    """Cache an API client on first use, creating it under `Config._client_lock`.
+
+    boto3 sessions are not thread safe and `cached_property` does not lock on every
+    Python version, so clients first used from worker threads are made one at a time.
+    """
+    name = f.__name__
+
+    @property
+    @wraps(f)
+    def wrapped(self):
+        try:
+            return self.__dict__[name]
+        except KeyError:
+            pass
+
+        with self._client_lock:
+            if name not in self.__dict__:
+                self.__dict__[name] = f(self)
+
+            return self.__dict__[name]
+
+    return wrapped
+
+
 @dataclass
 class Config:
     """Provide configuration and API connections for AWS and Notion."""
 
-    s3: Any = field(init=False)
-    transcription: Any = field(init=False)
-    voice_bucket: Any = field(init=False)
-    _notion_client: Client = None
+    _notion_client: Any = None
 
-    boto_config: botocore.config.Config = field(init=False)
-    boto_session: Any = field(init=False)
+    _db: Any = field(default=None, init=False, repr=False)
+    _db_lock: Any = field(default_factory=threading.RLock, init=False, repr=False)
+    _client_lock: Any = field(default_factory=threading.RLock, init=False, repr=False)
+    _cache: Dict[str, Any] = field(default_factory=dict, init=False, repr=False)
+    _dirty: Dict[str, Any] = field(default_factory=dict, init=False, repr=False)
 
     aws_region = "us-west-2"
+    max_pool_connections: int = 64
+    # seconds between polls of AWS Transcribe, backing off from base up to cap
+    poll_interval_base: float = 2.0
+    poll_interval_cap: float = 30.0
+    # give up waiting on a job after this many polls, about three hours at the cap
+    max_polls: int = 360
     aws_profile_name: str = "voice-transcription-user"
     bucket_name: str = "voice-transcription-notes"
 
-    @staticmethod
-    def inject_secrets():
-        """Cheaply inject environment variables without dependencies."""
+    _secrets_injected: ClassVar[bool] = False
+
+    @classmethod
+    def inject_secrets(cls):
+        """Cheaply inject environment variables without dependencies.
+
+        This only happens once per process, no matter how many `Config`s are made.
+        """
+        if cls._secrets_injected:
+            return
+
         for p in SECRETS_PATH.glob("*.secret.env"):
             with open(str(p.absolute())) as secret_f:
-                for line in secret_f.readlines():
-                    try:
-                        splits = line.split("=")
-                        k, v = splits[0], "=".join(splits[1:])
+                for line in secret_f:
+                    k, sep, v = line.rstrip("\n").partition("=")
+                    if sep:
                         os.environ[k] = v
-                    except ValueError:
-                        pass
+
+        cls._secrets_injected = True
 
     @property
-    def notion_client(self) -> Client:
+    def notion_client(self):
         """Cache the notion client as it is needed infrequently."""
         if not self._notion_client:
-            self._notion_client = Client(auth=os.environ["NOTION_TOKEN"])
+            from .notion.client import RateLimitedClient
+
+            with self._client_lock:
+                if not self._notion_client:
+                    self._notion_client = RateLimitedClient(
+                        auth=os.environ["NOTION_TOKEN"]
+                    )
 
         return self._notion_client
 
+    @cached_property
+    def boto_config(self):
+        """Provide the botocore client configuration."""
+        import botocore.config
+
+        return botocore.config.Config(region_name=self.aws_region)
+
+    @_client_property
+    def boto_session(self):
+        """Set up a boto3 session with S3 and Transcribe permissions."""
+        import boto3
+
+        return boto3.Session(profile_name=self.aws_profile_name)
+
+    @_client_property
+    def s3_client(self):
+        """Provide a low level S3 client which can be shared across threads.
+
+        The connection pool is sized so that concurrent multipart uploads across
+        several notes do not have to wait on, or discard, connections. Throttled
+        requests are retried adaptively.
+        """
+        import botocore.config
+
+        return self.boto_session.client(
+            "s3",
+            config=self.boto_config.merge(
+                botocore.config.Config(
+                    max_pool_connections=self.max_pool_connections,
+                    retries={"mode": "adaptive", "max_attempts": 5},
+                )
+            ),
+        )
+
+    @cached_property
+    def s3_transfer_config(self):
+        """Provide settings for multipart uploads of larger voice notes.
+
+        Files under `multipart_threshold` are still uploaded with a single PUT.
+        """
+        from boto3.s3.transfer import TransferConfig
+
+        return TransferConfig(
+            multipart_threshold=8 * 1024 * 1024,
+            multipart_chunksize=32 * 1024 * 1024,
+            max_concurrency=8,
+            use_threads=True,
+        )
+
+    @_client_property
+    def transcription(self):
+        """Provide the AWS Transcribe client."""
+        return self.boto_session.client("transcribe")
+
     def __post_init__(self):
-        """Modify the environment and set up API connections.
+        """Modify the environment and ensure paths are in place.
 
         1. Inject secrets into environment variables from .env files.
         2. Ensure relevant paths for file ingress and archiving are in place.
-        3. Setup boto3 with S3 and Transcribe permissions.
-        4. Setup the Notion API client.
+
+        API connections are set up lazily on first access.
         """
         self.inject_secrets()
 
         INGRESS_PATH.mkdir(exist_ok=True, parents=True)
         ARCHIVE_PATH.mkdir(exist_ok=True, parents=True)
 
-        self.boto_config = botocore.config.Config(
-            region_name=self.aws_region,
-        )
-        self.boto_session = boto3.Session(profile_name=self.aws_profile_name)
+    @contextmanager
+    def db(self):
+        """Provide the note database.
 
-        # Set up clients
-        self.s3 = self.boto_session.resource("s3")
-        self.transcription = self.boto_session.client("transcribe")
+        The database is opened on first use and kept open for the lifetime
+        of the process, rather than paying for an open/close on every access.
+        Access is serialized across threads as they share the one connection.
+        """
+        with self._db_lock:
+            if self._db is None:
+                self._db = SqliteShelf.open(DB_PATH, legacy_path=LEGACY_DB_PATH)
+                atexit.register(self._db.close)
+                # handlers run last in first out, so pending notes are written first
+                atexit.register(self.flush)
 
-        # Set up resources
-        self.voice_bucket = self.s3.Bucket(self.bucket_name)
+            yield self._db
 
     @contextmanager
-    def db(self):
-        """Open the note database."""
-        with shelve.open(str(DB_PATH.absolute())) as db:
-            yield db
+    def db_transaction(self):
+        """Provide the note database, committing writes together on exit."""
+        with self.db() as db:
+            with db.transaction():
+                yield db
 
     def get_by_name(self, name):
-        """Find a `VoiceNote` item by the filename associated to it."""
+        """Find a `VoiceNote` item by the filename associated to it.
+
+        Items are kept in memory after the first lookup, so that repeated lookups
+        do not need to hit the database and unpickle again.
+        """
+        with self.db() as db:
+            if name not in self._cache:
+                self._cache[name] = db[name]
+
+            return self._cache[name]
+
+    def invalidate(self, name):
+        """Forget any in memory copy of the item `name`, i.e. after deleting it."""
+        with self._db_lock:
+            self._cache.pop(name, None)
+            self._dirty.pop(name, None)
+
+    def all_items(self):
+        """Fetch every item in the notes database in a single pass."""
+        self.flush()
         with self.db() as db:
-            return db[name]
+            return list(db.values())
 
     def save(self, note):
         """Save the note to the notes database."""
         with self.db() as db:
             db[note.name] = note
+            self._cache[note.name] = note
+            self._dirty.pop(note.name, None)
+
+    def mark_dirty(self, note):
+        """Queue the note to be saved on the next `flush`.
+
+        Notes pass through several stages in quick succession, this lets us
+        write them once rather than after every stage.
+        """
+        with self._db_lock:
+            self._dirty[note.name] = note
+            self._cache[note.name] = note
+
+    def flush(self):
+        """Save all notes queued by `mark_dirty` in a single transaction."""
+        with self._db_lock:
+            if not self._dirty:
+                return
+
+            with self.db_transaction() as db:
+                for name, note in self._dirty.items():
+                    db[name] = note
+
+            self._dirty.clear()
 
 
 config = Config()
@@ -3,4 +3,5 @@
 .basics contains tools to generate JSON to be fed into the API.
 .search has querying tools.
 .template_journal_page has high level templating routines.
+.client has a rate limited API client.
 """
@@ -1,6 +1,10 @@
 """Utilities for generating JSON objects representing Notion blocks and rich text."""
+import sys
 from enum import Enum
-from typing import Any, List
+from types import MappingProxyType
+from typing import Any, Callable, List, Optional, Tuple
+
+from voice_notes.util import serialization
 
 __all__ = [
     "BlockType",
@@ -10,6 +14,24 @@ __all__ = [
     "parent_ref",
 ]
 
+# Limits imposed by the Notion API on a single `blocks.children.append` request
+MAX_CHILDREN_PER_REQUEST = 100
+# counts nested children as well as the top level blocks
+MAX_BLOCKS_PER_REQUEST = 1000
+MAX_PAYLOAD_BYTES = 500 * 1000
+
+# Read only template for rich text annotations, copied for each rich text object
+_DEFAULT_ANNOTATIONS = MappingProxyType(
+    {
+        "bold": False,
+        "italic": False,
+        "strikethrough": False,
+        "underline": False,
+        "code": False,
+        "color": "default",
+    }
+)
+
 
 def parent_ref(page_id: str):
     """Format a `page_id` as a parent reference for new page creation."""
@@ -37,6 +59,15 @@ class BlockType(str, Enum):
     Toggle = "toggle"
 
 
+# Interned plain `str` block type keys. These skip the enum machinery when building
+# blocks and, unlike the `str` subclass members, are accepted as keys by orjson.
+_PARAGRAPH = sys.intern(BlockType.Paragraph.value)
+_HEADING_1 = sys.intern(BlockType.Heading1.value)
+_HEADING_2 = sys.intern(BlockType.Heading2.value)
+_HEADING_3 = sys.intern(BlockType.Heading3.value)
+_TO_DO = sys.intern(BlockType.ToDo.value)
+
+
 def simple_title_properties(title: str):
     """Generate a full property block for a new page consisting only of a title."""
     return {"type": "title", "title": [{"type": "text", "text": {"content": title}}]}
@@ -46,22 +77,15 @@ class RichText:
     """Namespaced utilities for creating Notion rich text objects."""
 
     @staticmethod
-    def plain_text(text):
+    def plain_text(text, **annotations):
         """Create a plain rich text object.
 
         This is used as a utility method for other rich text
-        creation routines.
+        creation routines, which can pass any non-default `annotations`.
         """
         return {
             "plain_text": text,
-            "annotations": {
-                "bold": False,
-                "italic": False,
-                "strikethrough": False,
-                "underline": False,
-                "code": False,
-                "color": "default",
-            },
+            "annotations": {**_DEFAULT_ANNOTATIONS, **annotations},
             "type": "text",
             "text": {
                 "content": text,
@@ -71,18 +95,12 @@ class RichText:
     @staticmethod
     def code(text):
         """Create a code-type rich text object."""
-        block = RichText.plain_text(text)
-
-        block["annotations"]["code"] = True
-        return block
+        return RichText.plain_text(text, code=True)
 
     @staticmethod
     def bold(text):
         """Create a bold rich text object."""
-        block = RichText.plain_text(text)
-
-        block["annotations"]["bold"] = True
-        return block
+        return RichText.plain_text(text, bold=True)
 
 
 class Block:
@@ -118,8 +136,8 @@ class Block:
 
         return {
             "object": "block",
-            "type": BlockType.ToDo,
-            BlockType.ToDo: {"text": text, "checked": checked, "children": children},
+            "type": _TO_DO,
+            _TO_DO: {"text": text, "checked": checked, "children": children},
         }
 
     @staticmethod
@@ -128,8 +146,8 @@ class Block:
         text = Block.wrap_rich_text_list(text)
         return {
             "object": "block",
-            "type": BlockType.Heading1,
-            BlockType.Heading1: {
+            "type": _HEADING_1,
+            _HEADING_1: {
                 "text": text,
             },
         }
@@ -140,8 +158,8 @@ class Block:
         text = Block.wrap_rich_text_list(text)
         return {
             "object": "block",
-            "type": BlockType.Heading2,
-            BlockType.Heading2: {
+            "type": _HEADING_2,
+            _HEADING_2: {
                 "text": text,
             },
         }
@@ -152,8 +170,8 @@ class Block:
         text = Block.wrap_rich_text_list(text)
         return {
             "object": "block",
-            "type": BlockType.Heading3,
-            BlockType.Heading3: {
+            "type": _HEADING_3,
+            _HEADING_3: {
                 "text": text,
             },
         }
@@ -161,14 +179,12 @@ class Block:
     @staticmethod
     def href(link_url, text):
         """Create a paragraph block which represents a link with standard styling."""
-        text = RichText.plain_text(text)
+        text = RichText.plain_text(text, underline=True, color="blue")
         text["href"] = link_url
         text["text"]["link"] = {
             "type": "url",
             "url": link_url,
         }
-        text["annotations"]["underline"] = True
-        text["annotations"]["color"] = "blue"
 
         return Block.paragraph([text], [])
 
@@ -181,8 +197,8 @@ class Block:
 
         return {
             "object": "block",
-            "type": BlockType.Paragraph,
-            BlockType.Paragraph: {
+            "type": _PARAGRAPH,
+            _PARAGRAPH: {
                 "text": text,
                 "children": children,
             },
@@ -195,6 +211,100 @@ class Block:
         Like the rest of the methods here, this is for constructing block objects
         and consequently does not actually talk to the API.
         """
-        block_type = block["type"]
-        block[block_type]["children"] = [child] + block[block_type]["children"]
+        block[block["type"]]["children"].insert(0, child)
         return block
+
+    @staticmethod
+    def count_blocks(block) -> int:
+        """Count `block` along with all of its nested children."""
+        children = block[block["type"]].get("children", ())
+        return 1 + sum(Block.count_blocks(child) for child in children)
+
+    @staticmethod
+    def chunk_children(blocks: List[Any]) -> List[List[Any]]:
+        """Split `blocks` into groups which respect the Notion request size limits."""
+        chunks = []
+        current, current_count, current_size = [], 0, 0
+        for block in blocks:
+            count = Block.count_blocks(block)
+            size = len(serialization.dumps(block))
+            if current and (
+                len(current) >= MAX_CHILDREN_PER_REQUEST
+                or current_count + count > MAX_BLOCKS_PER_REQUEST
+                or current_size + size > MAX_PAYLOAD_BYTES
+            ):
+                chunks.append(current)
+                current, current_count, current_size = [], 0, 0
+
+            current.append(block)
+            current_count += count
+            current_size += size
+
+        if current:
+            chunks.append(current)
+
+        return chunks
+
+    @staticmethod
+    def chunk_groups(
+        groups: List[List[Any]],
+    ) -> List[Tuple[List[int], List[List[Any]]]]:
+        """Split groups of blocks into requests, without splitting a group across requests.
+
+        Consecutive groups which fit in a single request share it, a group too large for
+        one request gets requests of its own, split by `chunk_children`. Returns the
+        indices of the groups sent together along with the chunks to send for them.
+        """
+        batches = []
+        indices, current, current_count, current_size = [], [], 0, 0
+        for i, group in enumerate(groups):
+            count = sum(Block.count_blocks(block) for block in group)
+            size = sum(len(serialization.dumps(block)) for block in group)
+            if indices and (
+                len(current) + len(group) > MAX_CHILDREN_PER_REQUEST
+                or current_count + count > MAX_BLOCKS_PER_REQUEST
+                or current_size + size > MAX_PAYLOAD_BYTES
+            ):
+                batches.append((indices, [current]))
+                indices, current, current_count, current_size = [], [], 0, 0
+
+            if (
+                len(group) > MAX_CHILDREN_PER_REQUEST
+                or count > MAX_BLOCKS_PER_REQUEST
+                or size > MAX_PAYLOAD_BYTES
+            ):
+                batches.append(([i], Block.chunk_children(group)))
+                continue
+
+            indices.append(i)
+            current.extend(group)
+            current_count += count
+            current_size += size
+
+        if indices:
+            batches.append((indices, [current]))
+
+        return batches
+
+    @staticmethod
+    def batch_append(
+        notion,
+        parent_id: str,
+        blocks: List[Any],
+        start: int = 0,
+        progress: Optional[Callable[[int], None]] = None,
+    ):
+        """Append `blocks` as children of `parent_id` using as few requests as possible.
+
+        Unlike the other methods here, this one actually talks to the API. Rate limiting
+        is handled by the client, see `voice_notes.notion.client.RateLimitedClient`.
+
+        The first `start` requests are skipped, as already sent by an earlier call.
+        After each request, `progress` is called with the number of requests sent so
+        far, so that a caller can resume from there if a later one fails.
+        """
+        chunks = Block.chunk_children(blocks)
+        for sent, chunk in enumerate(chunks[start:], start + 1):
+            notion.blocks.children.append(block_id=parent_id, children=chunk)
+            if progress is not None:
+                progress(sent)
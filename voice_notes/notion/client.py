@@ -0,0 +1,97 @@
+"""A Notion API client which respects the API rate limits."""
+import logging
+import threading
+import time
+
+import httpx
+from notion_client import APIResponseError, Client
+
+from voice_notes.util import serialization
+
+__all__ = ["RateLimiter", "RateLimitedClient"]
+
+
+class FastJSONHTTPClient(httpx.Client):
+    """An `httpx.Client` which serializes JSON request bodies with `orjson`.
+
+    Transcript blocks make for large payloads, where the stdlib encoder is
+    a large fraction of the time spent outside the network.
+    """
+
+    def build_request(self, *args, json=None, **kwargs):
+        """Build a request, encoding any JSON body ourselves."""
+        if json is not None:
+            headers = httpx.Headers(kwargs.pop("headers", None))
+            headers["Content-Type"] = "application/json"
+            kwargs["headers"] = headers
+            kwargs["content"] = serialization.dumps(json)
+
+        return super().build_request(*args, **kwargs)
+
+
+class RateLimiter:
+    """A thread safe token bucket allowing `rate` requests per second on average.
+
+    Up to `burst` requests can be made back to back before we start spacing them out.
+    """
+
+    def __init__(self, rate: float = 3.0, burst: int = 3):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a request can be made without exceeding the rate limit."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.burst, self._tokens + (now - self._last) * self.rate
+            )
+            self._last = now
+
+            wait = (1 - self._tokens) / self.rate if self._tokens < 1 else 0.0
+            self._tokens -= 1
+
+        if wait > 0:
+            time.sleep(wait)
+
+    def pause(self, seconds: float):
+        """Push back all further requests by `seconds`, i.e. after a 429."""
+        with self._lock:
+            self._tokens = min(self._tokens, 0.0) - seconds * self.rate
+
+
+class RateLimitedClient(Client):
+    """A Notion client which throttles requests and retries rate limited ones.
+
+    Notion allows an average of three requests per second, requests beyond this
+    are rejected with HTTP 429 and a `Retry-After` header which we honor.
+    """
+
+    def __init__(
+        self, *args, rate_limiter: RateLimiter = None, max_retries=5, **kwargs
+    ):
+        if serialization.HAS_ORJSON:
+            kwargs.setdefault("client", FastJSONHTTPClient())
+
+        super().__init__(*args, **kwargs)
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.max_retries = max_retries
+
+    def request(self, *args, **kwargs):
+        """Send an HTTP request once the rate limiter allows it."""
+        delay = 1.0
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.acquire()
+            try:
+                return super().request(*args, **kwargs)
+            except APIResponseError as e:
+                if e.code != "rate_limited" or attempt == self.max_retries:
+                    raise
+
+                retry_after = float(e.headers.get("Retry-After", delay))
+                logging.info("Rate limited by Notion, retrying in %ss.", retry_after)
+                self.rate_limiter.pause(retry_after)
+                delay *= 2
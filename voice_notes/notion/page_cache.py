@@ -0,0 +1,64 @@
+"""A persistent cache of the IDs of journal pages.
+
+Journal pages are determined entirely by their date, so once we have found or
+created one we remember its ID on disk and skip searching Notion in the future.
+"""
+import sqlite3
+import threading
+from typing import Optional
+
+from voice_notes.config import ROOT_PATH
+
+__all__ = ["lookup", "store", "discard", "clear"]
+
+PAGE_CACHE_PATH = ROOT_PATH / "page_cache.sqlite"
+
+_conn = None
+_lock = threading.Lock()
+
+
+def _connection() -> sqlite3.Connection:
+    global _conn
+    if _conn is None:
+        _conn = sqlite3.connect(
+            str(PAGE_CACHE_PATH), check_same_thread=False, isolation_level=None
+        )
+        _conn.execute(
+            "CREATE TABLE IF NOT EXISTS page "
+            "(kind TEXT, key TEXT, id TEXT, PRIMARY KEY (kind, key))"
+        )
+
+    return _conn
+
+
+def lookup(kind: str, key: str) -> Optional[str]:
+    """Fetch the cached ID of the `kind` page for `key`, if there is one."""
+    with _lock:
+        row = (
+            _connection()
+            .execute("SELECT id FROM page WHERE kind = ? AND key = ?", (kind, key))
+            .fetchone()
+        )
+
+    return row[0] if row else None
+
+
+def store(kind: str, key: str, page_id: str):
+    """Remember `page_id` as the `kind` page for `key`."""
+    with _lock:
+        _connection().execute(
+            "INSERT OR REPLACE INTO page (kind, key, id) VALUES (?, ?, ?)",
+            (kind, key, page_id),
+        )
+
+
+def discard(page_id: str):
+    """Forget every cached entry for `page_id`, i.e. after it was deleted or archived."""
+    with _lock:
+        _connection().execute("DELETE FROM page WHERE id = ?", (page_id,))
+
+
+def clear():
+    """Forget all cached IDs, i.e. after journal pages were moved or deleted."""
+    with _lock:
+        _connection().execute("DELETE FROM page")
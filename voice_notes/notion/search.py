@@ -1,37 +1,118 @@
 """Tools for searching for pages."""
 import datetime
-from dataclasses import dataclass, field
-from typing import Any, Optional
+import functools
+import threading
+from concurrent.futures import Future
+from contextlib import contextmanager
+from typing import Any, Dict, Optional, Tuple
+
+from . import page_cache
 
 __all__ = [
     "Page",
-    "match_page",
     "get_page_matching_exact_title",
     "get_monthly_page_id",
     "get_daily_page_id",
-    "get_monthly_page_id",
     "get_by_month_index_id",
+    "search_cache_invalidate",
+    "invalidate_on_missing_page",
 ]
 
+# We only ever look for pages, so let the API skip databases
+_PAGES_ONLY = {"value": "page", "property": "object"}
+
+_inflight: Dict[Tuple[Any, str], Future] = {}
+_inflight_lock = threading.Lock()
+
+
+def _search(notion, query: str):
+    """Search Notion for pages matching `query`."""
+    return notion.search(query=query, filter=_PAGES_ONLY)["results"]
+
+
+def _single_flight_search(notion, query: str):
+    """Search Notion for `query`, sharing the request with concurrent identical searches.
+
+    The first caller makes the request, others wait for its result.
+    """
+    key = (notion, query)
+    with _inflight_lock:
+        future = _inflight.get(key)
+        is_owner = future is None
+        if is_owner:
+            future = _inflight[key] = Future()
+
+    if is_owner:
+        try:
+            future.set_result(_search(notion, query))
+        except Exception as e:
+            future.set_exception(e)
+        finally:
+            with _inflight_lock:
+                del _inflight[key]
+
+    return future.result()
+
+
+@functools.lru_cache(maxsize=256)
+def _cached_search(notion, query: str):
+    """Search Notion for `query`, remembering the results for the rest of the process.
+
+    The queries we make are few and repetitive. Call `search_cache_invalidate` after
+    creating pages so that they can be found.
+    """
+    return _single_flight_search(notion, query)
+
+
+def search_cache_invalidate():
+    """Forget all remembered search results."""
+    _cached_search.cache_clear()
+
+
+def _is_missing_page_error(error: Exception) -> bool:
+    code = getattr(error, "code", None)
+    return code == "object_not_found" or (
+        code == "validation_error" and "archived" in str(error)
+    )
+
+
+@contextmanager
+def invalidate_on_missing_page(page_id: str):
+    """Forget the cached `page_id` if the API reports it as deleted or archived.
+
+    The error is still raised, the next lookup searches Notion again.
+    """
+    try:
+        yield
+    except Exception as e:
+        if _is_missing_page_error(e):
+            page_cache.discard(page_id)
+            search_cache_invalidate()
+
+        raise
+
 
-@dataclass
 class Page:
-    """Representation of a Notion page."""
+    """Representation of a Notion page.
 
-    archived: bool = field(repr=False)
-    id: str
-    url: str = field(repr=False)
+    Only the fields we read are kept, the rest of the API response is discarded.
+    Where only the ID of a response is needed, read `response["id"]` instead, and
+    when retrieving pages pass `filter_properties=["title"]` to keep them small.
+    """
 
-    created_time: str = field(repr=False)
-    last_edited_time: str = field(repr=False)
+    __slots__ = ("id", "properties")
 
-    object: str = field(repr=False)
+    def __init__(self, id: str, properties: Any):
+        self.id = id
+        self.properties = properties
 
-    properties: Any = field(repr=False)
+    @classmethod
+    def from_dict(cls, page: Dict[str, Any]) -> "Page":
+        """Construct from an API response, keeping only the fields we read."""
+        return cls(page["id"], page["properties"])
 
-    parent: Any = None
-    cover: Any = field(default=None, repr=False)
-    icon: Any = field(default=None, repr=False)
+    def __repr__(self) -> str:
+        return f"Page(id={self.id!r})"
 
     @property
     def plain_text_title(self):
@@ -41,8 +122,8 @@ class Page:
 
 def get_page_matching_exact_title(notion, title: str) -> Optional[str]:
     """Find a unique page whose plain text title exactly matches `title`."""
-    pages = notion.search(query=title)["results"]
-    pages = [Page(**p) for p in pages]
+    pages = _cached_search(notion, title)
+    pages = [Page.from_dict(p) for p in pages]
     pages = [p for p in pages if p.plain_text_title == title]
 
     assert len(pages) < 2
@@ -51,21 +132,29 @@ def get_page_matching_exact_title(notion, title: str) -> Optional[str]:
 
 def get_by_month_index_id(notion) -> str:
     """Fetch the ID of the top level journal index."""
-    personal_journal_page = notion.search(query=f"Personal Journals by Month")[
-        "results"
-    ]
-    personal_journal_page = [Page(**p) for p in personal_journal_page]
+    cached_id = page_cache.lookup("index", "")
+    if cached_id:
+        return cached_id
+
+    personal_journal_page = _cached_search(notion, "Personal Journals by Month")
+    personal_journal_page = [Page.from_dict(p) for p in personal_journal_page]
     assert len(personal_journal_page) == 1
     personal_journal_page = personal_journal_page[0]
+
+    page_cache.store("index", "", personal_journal_page.id)
     return personal_journal_page.id
 
 
 def get_monthly_page_id(notion, query_date: datetime.datetime) -> Optional[str]:
     """Fetch the ID of a monthly journal page index for `query_date`."""
     monthly_slug = f"{query_date.year}/{query_date.month}"
+    cached_id = page_cache.lookup("monthly", monthly_slug)
+    if cached_id:
+        return cached_id
+
     reject_daily_slug = f"{query_date.year}/{query_date.month}/"
-    page_search = notion.search(query=f"Personal Journal {monthly_slug}")["results"]
-    results = [Page(**p) for p in page_search]
+    page_search = _cached_search(notion, f"Personal Journal {monthly_slug}")
+    results = [Page.from_dict(p) for p in page_search]
     results = [
         r
         for r in results
@@ -74,12 +163,24 @@ def get_monthly_page_id(notion, query_date: datetime.datetime) -> Optional[str]:
     ]
 
     assert len(results) < 2
-    return results[0].id if results else None
+    if not results:
+        return None
+
+    page_cache.store("monthly", monthly_slug, results[0].id)
+    return results[0].id
 
 
 def get_daily_page_id(notion, query_date: datetime.datetime) -> Optional[str]:
     """Fetch the ID of a daily journal page for `query_date`."""
-    daily_slug = (
-        f"Personal Journal {query_date.year}/{query_date.month}/{query_date.day}"
+    daily_key = f"{query_date.year}/{query_date.month}/{query_date.day}"
+    cached_id = page_cache.lookup("daily", daily_key)
+    if cached_id:
+        return cached_id
+
+    daily_page_id = get_page_matching_exact_title(
+        notion, f"Personal Journal {daily_key}"
     )
-    return get_page_matching_exact_title(notion, daily_slug)
+    if daily_page_id:
+        page_cache.store("daily", daily_key, daily_page_id)
+
+    return daily_page_id
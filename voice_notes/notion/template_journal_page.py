@@ -1,14 +1,17 @@
 """Utilities for templating new journal pages."""
 
 import datetime
+from concurrent.futures import ThreadPoolExecutor
 
 from .search import (
-    Page,
     get_by_month_index_id,
     get_daily_page_id,
     get_monthly_page_id,
+    invalidate_on_missing_page,
+    search_cache_invalidate,
 )
 from .basics import parent_ref, simple_title_properties, Block
+from . import page_cache
 
 __all__ = ["new_monthly_page", "new_daily_page", "get_or_create_daily_page_id"]
 
@@ -21,45 +24,73 @@ def new_monthly_page(for_date: datetime.datetime):
     return properties, children
 
 
+# The daily page content does not depend on the date, so it is built only once.
+# The blocks are shared between pages and should be treated as read only.
+_DAILY_PAGE_CHILDREN = (
+    Block.h1("Agenda"),
+    Block.todo("Plan your day"),
+    Block.h1("General notes"),
+    Block.h1("Voice notes"),
+)
+
+
 def new_daily_page(for_date: datetime.datetime):
     """Generate properties and block content for a daily journal page."""
     title_for_page = f"Personal Journal {for_date.year}/{for_date.month}/{for_date.day}"
     properties = {"title": simple_title_properties(title_for_page)}
-    children = [
-        Block.h1("Agenda"),
-        Block.todo("Plan your day"),
-        Block.h1("General notes"),
-        Block.h1("Voice notes"),
-    ]
+    children = list(_DAILY_PAGE_CHILDREN)
 
     return properties, children
 
 
 def get_or_create_daily_page_id(notion, query_date: datetime.datetime) -> str:
-    """Fetch or create the ID of a daily journal page corresponding to `query_date`."""
-    journal_page_id = get_by_month_index_id(notion)
-    monthly_page_id = get_monthly_page_id(notion, query_date)
+    """Fetch or create the ID of a daily journal page corresponding to `query_date`.
+
+    Page IDs are cached on disk by `page_cache`, so once a day's page exists this
+    does not talk to the API at all.
+    """
+    daily_key = f"{query_date.year}/{query_date.month}/{query_date.day}"
+    cached_id = page_cache.lookup("daily", daily_key)
+    if cached_id:
+        return cached_id
+
+    # These lookups are independent, so make them concurrently. Pages are only
+    # created afterwards, as we need the IDs of their parents.
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        journal_future = executor.submit(get_by_month_index_id, notion)
+        monthly_future = executor.submit(get_monthly_page_id, notion, query_date)
+        daily_future = executor.submit(get_daily_page_id, notion, query_date)
+
+    journal_page_id = journal_future.result()
+    monthly_page_id = monthly_future.result()
+    daily_page_id = daily_future.result()
 
     # Check if we need to make a monthly level organization page
     if not monthly_page_id:
         properties, children = new_monthly_page(query_date)
-        created_page = notion.pages.create(
-            parent=parent_ref(journal_page_id),
-            properties=properties,
-            children=children,
+        with invalidate_on_missing_page(journal_page_id):
+            created_page = notion.pages.create(
+                parent=parent_ref(journal_page_id),
+                properties=properties,
+                children=children,
+            )
+        monthly_page_id = created_page["id"]
+        page_cache.store(
+            "monthly", f"{query_date.year}/{query_date.month}", monthly_page_id
         )
-        monthly_page_id = Page(**created_page).id
+        search_cache_invalidate()
 
     # Check if we need to make a daily level organization page
-    daily_page_id = get_daily_page_id(notion, query_date)
-
     if not daily_page_id:
         properties, children = new_daily_page(query_date)
-        created_page = notion.pages.create(
-            parent=parent_ref(monthly_page_id),
-            properties=properties,
-            children=children,
-        )
-        daily_page_id = Page(**created_page).id
+        with invalidate_on_missing_page(monthly_page_id):
+            created_page = notion.pages.create(
+                parent=parent_ref(monthly_page_id),
+                properties=properties,
+                children=children,
+            )
+        daily_page_id = created_page["id"]
+        page_cache.store("daily", daily_key, daily_page_id)
+        search_cache_invalidate()
 
     return daily_page_id
@@ -1,11 +1,13 @@
 """Provides structured representation of audio transcripts."""
+from bisect import bisect_left
 from dataclasses import dataclass, field
-import datetime
+import itertools
 import logging
 import math
+import operator
 from typing import Any, Dict, List, Optional
 
-from voice_notes.notion.basics import RichText, Block
+from voice_notes.notion.basics import RichText, Block, MAX_CHILDREN_PER_REQUEST
 
 __all__ = ["Transcript", "FormattingSettings", "NoSpeakersException"]
 
@@ -49,6 +51,10 @@ class AWSTimestamped:
             self.end_time = float(self.end_time)
 
 
+def _as_time(value):
+    return float(value) if value else value
+
+
 @dataclass
 class AWSSegment(AWSTimestamped):
     speaker_label: str = "spk_0"
@@ -59,6 +65,21 @@ class AWSSegment(AWSTimestamped):
         super().__post_init__()
         self.speaker_label = self.speaker_label.replace("spk_", "S")
 
+    @classmethod
+    def from_aws(cls, index: int, segment: Dict[str, Any]) -> "AWSSegment":
+        """Construct from an AWS Transcribe segment, skipping the generated `__init__`.
+
+        This is equivalent to `AWSSegment(index=index, **segment)`, but it is
+        called for every segment, so we avoid the keyword argument handling.
+        """
+        self = cls.__new__(cls)
+        self.start_time = _as_time(segment.get("start_time"))
+        self.end_time = _as_time(segment.get("end_time"))
+        self.speaker_label = segment.get("speaker_label", "spk_0").replace("spk_", "S")
+        self.items = segment.get("items", [])
+        self.index = index
+        return self
+
 
 @dataclass
 class AWSTranscriptItem(AWSTimestamped):
@@ -66,6 +87,21 @@ class AWSTranscriptItem(AWSTimestamped):
     alternatives: List[Dict[str, Any]] = field(default_factory=list)
     segment: Optional[AWSSegment] = None
 
+    @classmethod
+    def from_aws(cls, item: Dict[str, Any]) -> "AWSTranscriptItem":
+        """Construct from an AWS Transcribe item, skipping the generated `__init__`.
+
+        This is called once per token, so it avoids the keyword argument handling
+        and `__post_init__` call of `AWSTranscriptItem(**item)`.
+        """
+        self = cls.__new__(cls)
+        self.start_time = _as_time(item.get("start_time"))
+        self.end_time = _as_time(item.get("end_time"))
+        self.type = item.get("type", "")
+        self.alternatives = item.get("alternatives", [])
+        self.segment = None
+        return self
+
     @property
     def speaker(self):
         return self.segment.speaker_label
@@ -76,6 +112,8 @@ class AWSTranscriptItem(AWSTimestamped):
 
 
 class TranscriptItem:
+    speaker: str = ""
+
     def to_string(self):
         return str(self)
 
@@ -86,11 +124,40 @@ class TranscriptItem:
         return False
 
 
-@dataclass
 class TextItem(TranscriptItem):
-    text: str = ""
-    speaker: str = "S0"
-    segment_index: int = 0
+    def __init__(self, text: str = "", speaker: str = "S0", segment_index: int = 0):
+        self.speaker = speaker
+        self.segment_index = segment_index
+        # Text is accumulated one token at a time, so we keep the pieces and join them
+        # when needed rather than building a new string for every token.
+        self._parts: List[str] = [text] if text else []
+
+    def __repr__(self) -> str:
+        return (
+            f"TextItem(text={self.text!r}, speaker={self.speaker!r}, "
+            f"segment_index={self.segment_index!r})"
+        )
+
+    def __eq__(self, other) -> bool:
+        if other.__class__ is not self.__class__:
+            return NotImplemented
+
+        return (self.text, self.speaker, self.segment_index) == (
+            other.text,
+            other.speaker,
+            other.segment_index,
+        )
+
+    @property
+    def text(self) -> str:
+        if len(self._parts) != 1:
+            self._parts = ["".join(self._parts)]
+
+        return self._parts[0]
+
+    @text.setter
+    def text(self, value: str):
+        self._parts = [value]
 
     def to_rich_text(self):
         return RichText.plain_text(self.text)
@@ -115,31 +182,39 @@ class TextItem(TranscriptItem):
     def __iadd__(self, other):
         if isinstance(other, AWSTranscriptItem):
             if other.type != "punctuation":
-                self.text += " "
+                self._parts.append(" ")
 
             other = other.content
         else:
-            self.text += " "
+            self._parts.append(" ")
 
-        self.text += str(other)
+        self._parts.append(str(other))
         return self
 
 
 @dataclass
 class Timestamp(TranscriptItem):
-    delta: datetime.timedelta = None
+    seconds: int = 0
+    speaker: str = ""
+    _formatted: Optional[str] = field(
+        default=None, init=False, repr=False, compare=False
+    )
 
     def to_rich_text(self):
         return RichText.code(str(self))
 
     @classmethod
-    def from_start_time(cls, start_time):
-        start_time = int(math.floor(float(start_time)))
-        return cls(delta=datetime.timedelta(seconds=start_time))
+    def from_start_time(cls, start_time, speaker=""):
+        return cls(seconds=int(math.floor(float(start_time))), speaker=speaker)
 
     def __str__(self) -> str:
-        """Provide str() for string output of transcripts."""
-        return f"[{str(self.delta)}]"
+        """Provide str() for string output of transcripts, formatted as [H:MM:SS]."""
+        if self._formatted is None:
+            h, rem = divmod(self.seconds, 3600)
+            m, s = divmod(rem, 60)
+            self._formatted = f"[{h:d}:{m:02d}:{s:02d}]"
+
+        return self._formatted
 
 
 @dataclass
@@ -151,11 +226,28 @@ class Transcript:
 
     items: List[TranscriptItem] = field(default_factory=list)
     segments: List[AWSSegment] = field(default_factory=list)
+    segment_end_times: List[float] = field(default_factory=list, repr=False)
     segment_index: int = 0
     n_speakers: int = 0
 
     settings: FormattingSettings = field(default_factory=FormattingSettings)
 
+    @staticmethod
+    def max_speaker_turns(aws_json) -> int:
+        """Bound the number of speaker turns from the raw AWS Transcribe JSON.
+
+        `speaker_labels["speakers"]` only counts distinct speakers, so instead we
+        count runs of segments with the same speaker. Segments without words can
+        only split turns, so this is at least `len(items_by_speaker())`.
+        """
+        if "jobName" in aws_json:
+            aws_json = aws_json["results"]
+
+        segments = aws_json.get("speaker_labels", {}).get("segments", [])
+        return sum(
+            1 for _ in itertools.groupby(s.get("speaker_label") for s in segments)
+        )
+
     @classmethod
     def from_aws_transcribe_json(cls, aws_json, **kwargs):
         """Create a transcript from the JSON results of an AWS Transcribe batch job."""
@@ -170,9 +262,10 @@ class Transcript:
             raise NoSpeakersException
 
         t.segments = [
-            AWSSegment(index=i, **s)
+            AWSSegment.from_aws(i, s)
             for i, s in enumerate(aws_json["speaker_labels"]["segments"])
         ]
+        t.segment_end_times = [s.end_time for s in t.segments]
         t.segment_index = 0
 
         for item in aws_json["items"]:
@@ -181,59 +274,80 @@ class Transcript:
         return t
 
     def items_by_speaker(self) -> List[List[TranscriptItem]]:
-        """Group tokens in the transcript according to speaker segments."""
-        by_speaker = []
-        current = []
-
-        current_speaker = None
-        for item in self.items:
-            will_append = True
-            if isinstance(item, TextItem):
-                if current_speaker is None:
-                    current_speaker = item.speaker
-                if current_speaker != item.speaker:
-                    current_speaker = item.speaker
-                    will_append = False
-
-            if not will_append:
-                by_speaker.append(current)
-                current = []
-
-            current.append(item)
-
-        by_speaker.append(current)
-        return by_speaker
+        """Group tokens in the transcript according to speaker segments.
+
+        Timestamps carry the speaker of the text around them, see `__iadd__`.
+        """
+        return [
+            list(group)
+            for _, group in itertools.groupby(
+                self.items, key=operator.attrgetter("speaker")
+            )
+        ]
 
     def to_string(self) -> str:
         """Convert the transcript into a string for simple output."""
         results = []
 
         for group in self.items_by_speaker():
-            speaker = [g for g in group if isinstance(g, TextItem)][0].speaker
+            speaker = group[0].speaker
             item = f"{speaker}: {''.join([str(g) for g in group])}"
             results.append(item)
 
         return "\n".join(results)
 
-    def to_block(self, block_title):
-        """Convert the transcript into a Notion block object."""
+    def to_paragraphs(self) -> List[Any]:
+        """Convert the transcript into a list of Notion paragraphs, one per speaker turn."""
         children = []
         for group in self.items_by_speaker():
-            speaker = [g for g in group if isinstance(g, TextItem)][0].speaker
+            speaker = group[0].speaker
             text_items = [RichText.bold(speaker), RichText.plain_text(": ")]
 
             spacer = ""
             for g in group:
+                # render without touching `g`, so a transcript can be rendered repeatedly
                 if isinstance(g, TextItem):
-                    g.text = f"{spacer}{g.text} "
+                    text_items.append(RichText.plain_text(f"{spacer}{g.text} "))
                     spacer = ""
                 else:
+                    text_items.append(g.to_rich_text())
                     spacer = " "
-
-                text_items.append(g.to_rich_text())
             children.append(Block.paragraph(text_items))
 
-        return Block.paragraph(block_title, children=children)
+        return children
+
+    def to_block(self, block_title):
+        """Convert the transcript into a Notion block object."""
+        return Block.paragraph(block_title, children=self.to_paragraphs())
+
+    def to_block_chunks(
+        self,
+        block_title,
+        chunk_size: int = MAX_CHILDREN_PER_REQUEST,
+        header_children: Optional[List[Any]] = None,
+    ):
+        """Convert the transcript into a header block and chunks of further paragraphs.
+
+        The Notion API accepts at most 100 children per block in a request, so
+        paragraphs which do not fit under the header are returned separately in
+        chunks of `chunk_size`, to be appended after the header in order.
+        `header_children` are placed at the front of the header's children.
+        """
+        header_children = list(header_children or [])
+        paragraphs = self.to_paragraphs()
+
+        n_header = chunk_size - len(header_children)
+        header = Block.paragraph(
+            block_title, children=header_children + paragraphs[:n_header]
+        )
+        chunks = [
+            paragraphs[i : i + chunk_size]
+            for i in range(n_header, len(paragraphs), chunk_size)
+        ]
+
+        assert len(header[header["type"]]["children"]) <= MAX_CHILDREN_PER_REQUEST
+        assert all(len(chunk) <= MAX_CHILDREN_PER_REQUEST for chunk in chunks)
+        return header, chunks
 
     def __post_init__(self):
         """Initialize the next timestamp we will add according to desired frequency."""
@@ -247,16 +361,25 @@ class Transcript:
     def __iadd__(self, token):
         """Add a token (from the token utterance stream) to the transcript."""
         assert isinstance(token, dict)
-        token = AWSTranscriptItem(**token)
+        token = AWSTranscriptItem.from_aws(token)
 
         if token.type != "punctuation":
-            while self.current_segment.end_time < token.start_time:
-                self.segment_index += 1
+            if self.segment_end_times:
+                # segments are in chronological order, so binary search the
+                # first one ending after this token starts
+                self.segment_index = bisect_left(
+                    self.segment_end_times, token.start_time, lo=self.segment_index
+                )
+            else:
+                while self.current_segment.end_time < token.start_time:
+                    self.segment_index += 1
 
         token.segment = self.current_segment
 
         if token.start_time and token.start_time > self.next_timestamp:
-            self.items.append(Timestamp.from_start_time(token.start_time))
+            # stamp with the current speaker so the timestamp stays in their turn
+            speaker = self.items[-1].speaker if self.items else token.speaker
+            self.items.append(Timestamp.from_start_time(token.start_time, speaker))
             self.next_timestamp += self.timestamp_every
 
         if self.items and self.items[-1].accepts(token, self.settings):
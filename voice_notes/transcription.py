@@ -1,15 +1,45 @@
 """Implements batch transcription on AWS Transcribe."""
 import uuid
 import logging
+import random
 from dataclasses import field, dataclass
 from enum import Enum
-from typing import Any, Type
+from typing import Any, Iterator, Type
 import time
 import requests
+from requests.adapters import HTTPAdapter
 
 from .config import Config
+from .util import serialization
 
-__all__ = ["TranscriptionStatus", "TranscriptionJob"]
+__all__ = [
+    "TranscriptionStatus",
+    "TranscriptionJob",
+    "TranscriptionFailed",
+    "poll_delays",
+]
+
+# Transcripts are all served from the same host, so keep connections alive between
+# fetches rather than paying for a new TLS handshake each time.
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(pool_connections=10, pool_maxsize=10))
+
+
+def poll_delays(config: Config, backoff: float = 1.5) -> Iterator[float]:
+    """Yield the delays between polls of a transcription job.
+
+    Polling starts quickly, so that short notes finish promptly, and backs off
+    exponentially up to `config.poll_interval_cap` to avoid hammering the API on
+    long ones. Delays are jittered so jobs started together do not poll in lockstep.
+    """
+    delay = config.poll_interval_base
+    while True:
+        yield delay + random.uniform(0, delay / 4)
+        delay = min(delay * backoff, config.poll_interval_cap)
+
+
+class TranscriptionFailed(Exception):
+    """Raised when AWS Transcribe reports that a job failed."""
 
 
 class TranscriptionStatus(str, Enum):
@@ -57,43 +87,49 @@ class TranscriptionJob:
 
         return job
 
+    def describe(self) -> Any:
+        """Fetch the description of a previously started job on AWS Transcribe."""
+        assert self.started
+        return self.config.transcription.get_transcription_job(
+            TranscriptionJobName=self.job_name
+        )["TranscriptionJob"]
+
     @property
     def status(self) -> TranscriptionStatus:
         """Determine the status of a previously started job on AWS Transcribe."""
-        assert self.started
-        job = self.config.transcription.get_transcription_job(
-            TranscriptionJobName=self.job_name
-        )
-        job_status = job["TranscriptionJob"]["TranscriptionJobStatus"]
-        return TranscriptionStatus(job_status)
+        return TranscriptionStatus(self.describe()["TranscriptionJobStatus"])
 
     def block_on_transcript(self) -> Any:
-        """Poll until the transcription job is finished and fetch the transcript."""
-        while True:
-            logging.info(f"Polling transcription job for {self.job_uri}")
-            status = self.status
+        """Poll until the transcription job is finished and fetch the transcript.
+
+        See `poll_delays` for how long we wait between polls.
+        """
+        for delay in poll_delays(self.config):
+            logging.info("Polling transcription job for %s", self.job_uri)
+            job = self.describe()
+            status = TranscriptionStatus(job["TranscriptionJobStatus"])
             if status == TranscriptionStatus.FAILED:
                 logging.error(
-                    f"Could not complete transcription job for {self.job_uri}."
+                    "Could not complete transcription job for %s.", self.job_uri
                 )
-                raise ValueError("Could not complete transcription.")
+                raise TranscriptionFailed("Could not complete transcription.")
             elif status == TranscriptionStatus.COMPLETED:
-                job = self.config.transcription.get_transcription_job(
-                    TranscriptionJobName=self.job_name
-                )
-                transcript_uri = job["TranscriptionJob"]["Transcript"][
-                    "TranscriptFileUri"
-                ]
+                transcript_uri = job["Transcript"]["TranscriptFileUri"]
                 return self.fetch_transcript(transcript_uri)
 
-            time.sleep(3.0)
+            time.sleep(delay)
 
     @staticmethod
     def fetch_transcript(transcript_uri: str) -> Any:
-        """Fetch a finished transcript from AWS Transcribe."""
-        response = requests.get(transcript_uri)
-        if response.status_code != 200:
-            logging.error("Failed to fetch finished transcript.")
-            return None
-
-        return response.json()
+        """Fetch a finished transcript from AWS Transcribe.
+
+        The body is parsed straight from the raw bytes, which avoids holding a
+        decoded copy of the whole (possibly several MB) document as `str` too,
+        using `orjson` when available.
+        """
+        with _SESSION.get(transcript_uri, stream=True, timeout=30) as response:
+            if response.status_code != 200:
+                logging.error("Failed to fetch finished transcript.")
+                return None
+
+            return serialization.loads(response.content)
@@ -0,0 +1 @@
+"""Small utilities shared across the package which do not need API access."""
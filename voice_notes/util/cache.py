@@ -0,0 +1,23 @@
+"""Per-process caches for otherwise repeated filesystem scans."""
+import functools
+from pathlib import Path
+from typing import Tuple
+
+from .fs import iter_mp3s
+
+__all__ = ["list_ingress_mp3s"]
+
+
+@functools.lru_cache(maxsize=8)
+def _list_mp3s(path: Path, mtime_ns: int) -> Tuple[Path, ...]:
+    entries = sorted(iter_mp3s(path), key=lambda e: e.name)
+    return tuple(Path(e.path) for e in entries)
+
+
+def list_ingress_mp3s(path: Path) -> Tuple[Path, ...]:
+    """List the mp3s in `path`, sorted by name so that they are in recording order.
+
+    The listing is cached against the directory modification time, which changes
+    whenever files are added or removed, so repeated calls only pay for a `stat`.
+    """
+    return _list_mp3s(path, path.stat().st_mtime_ns)
@@ -0,0 +1,18 @@
+"""Filesystem helpers."""
+import os
+from pathlib import Path
+from typing import Iterator
+
+__all__ = ["iter_mp3s"]
+
+
+def iter_mp3s(path: Path) -> Iterator[os.DirEntry]:
+    """Yield directory entries for the mp3s directly inside `path`.
+
+    Entries are filtered on their name alone, so no `stat` is made until a caller
+    asks for one.
+    """
+    with os.scandir(path) as it:
+        for entry in it:
+            if entry.name.endswith(".mp3"):
+                yield entry
@@ -0,0 +1,27 @@
+"""JSON (de)serialization, using `orjson` when it is installed."""
+import json
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+__all__ = ["dumps", "loads", "HAS_ORJSON"]
+
+HAS_ORJSON = orjson is not None
+
+
+def dumps(obj) -> bytes:
+    """Serialize `obj` to UTF-8 encoded JSON."""
+    if orjson is not None:
+        return orjson.dumps(obj)
+
+    return json.dumps(obj, ensure_ascii=False).encode("utf-8")
+
+
+def loads(data):
+    """Deserialize JSON from `bytes` or `str`."""
+    if orjson is not None:
+        return orjson.loads(data)
+
+    return json.loads(data)
@@ -1,4 +1,5 @@
 """Models the ETL pipeline for voice notes."""
+import asyncio
 import warnings
 import datetime
 import os
@@ -6,20 +7,31 @@ from dataclasses import dataclass, field
 from enum import Enum
 from pathlib import Path
 import shutil
-from typing import Any, Callable, Optional
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
 import functools
+import itertools
 
 import logging
-from botocore.exceptions import ClientError
+from tqdm import tqdm
 from voice_notes.notion.basics import RichText, Block
-from voice_notes.notion.search import get_daily_page_id
+from voice_notes.notion.search import get_daily_page_id, invalidate_on_missing_page
 
 from voice_notes.transcript import FormattingSettings, NoSpeakersException, Transcript
 
-from .transcription import TranscriptionJob
+from .transcription import (
+    TranscriptionFailed,
+    TranscriptionJob,
+    TranscriptionStatus,
+    poll_delays,
+)
 from .config import Config, INGRESS_PATH, ARCHIVE_PATH
 
-__all__ = ["VoiceNote", "VoiceNoteStatus"]
+__all__ = ["VoiceNote", "VoiceNoteStatus", "synchronize_batch", "add_batch_to_notion"]
+
+# settings are only read while parsing, so every note can share these
+DEFAULT_SETTINGS = FormattingSettings()
+CONCAT_SETTINGS = FormattingSettings(break_speakers=False)
 
 
 class VoiceNoteStatus(int, Enum):
@@ -28,20 +40,24 @@ class VoiceNoteStatus(int, Enum):
     Ingress = 0  # Waiting for processing
     Local = 10  # Saved in on disk archive only
     S3 = 20  # Saved on S3
+    TranscriptionStarted = 25  # Submitted to AWS Transcribe, awaiting the result
     Transcribed = 30  # Finished AWS Transcribe job
     Notion = 40  # Formatted and synchronized to Notion
     Evicted = 50  # Item has no speech or was removed by user
 
 
 def bump_status(status: VoiceNoteStatus):
-    """Conveniently set the status attribute after successful completion of an ETL step."""
+    """Conveniently set the status attribute after successful completion of an ETL step.
+
+    The note is only queued for saving, call `Config.flush` to write it.
+    """
 
     def inner_decorator(f: Callable):
         @functools.wraps(f)
-        def wrapped_f(self, config: Config, *args):
-            if f(self, config, *args):
+        def wrapped_f(self, config: Config, *args, **kwargs):
+            if f(self, config, *args, **kwargs):
                 self.status = status
-                config.save(self)
+                config.mark_dirty(self)
 
         return wrapped_f
 
@@ -55,35 +71,94 @@ class VoiceNote:
     path: Path
     status: VoiceNoteStatus = VoiceNoteStatus.Ingress
     transcript: Any = field(default=None, repr=False)
+    transcription_job: Optional[str] = None
+    # requests of blocks already appended to Notion, so a partial append can resume
+    notion_chunks_sent: int = 0
 
-    @property
+    def __getstate__(self):
+        # the parsed transcript is derived from `transcript`, don't store it twice
+        state = self.__dict__.copy()
+        state.pop("parsed_transcript", None)
+        return state
+
+    @functools.cached_property
     def ingress_relative_path(self) -> Optional[Path]:
         """Determine the path for the associated media file relative the ingress location."""
         # a sanity check in order to ensure that we don't
-        assert "mp3" in self.name
+        assert self.path.suffix == ".mp3"
         try:
             return self.path.relative_to(INGRESS_PATH)
         except ValueError:
             return None
 
-    @property
+    @functools.cached_property
     def name(self) -> str:
         """Fetch the name from the filename of the original media."""
         return self.path.name
 
-    def safe_synchronize(self, config: Config):
+    def safe_synchronize(self, config: Config, to_notion: bool = True, wait=True):
         """Log errors from synchronization."""
         try:
-            self.synchronize(config)
+            self.synchronize(config, to_notion=to_notion, wait=wait)
         except Exception as e:
-            logging.error(f"Unhandled exception: {e}.")
+            logging.error("Unhandled exception: %s.", e)
+
+    def synchronize(self, config: Config, to_notion: bool = True, wait=True):
+        """Run the full ETL pipeline for an voice note as MP3.
 
-    def synchronize(self, config: Config):
-        """Run the full ETL pipeline for an voice note as MP3."""
-        self.cache_local(config)
-        self.upload_to_s3(config)
-        self.transcribe_on_s3(config)
-        self.add_to_notion(config)
+        Pass `to_notion=False` to stop after transcription, which is useful when
+        the final step needs to happen in a particular order across notes.
+        Pass `wait=False` to return as soon as the transcription job is started,
+        a later call picks the transcript up once it is done.
+        """
+        try:
+            if self.status == VoiceNoteStatus.Ingress:
+                # a failed upload leaves the note Local, retried on the next run
+                self.archive_and_upload(config)
+            else:
+                self.upload_to_s3(config)
+            self.start_transcription(config)
+            self.finalize_transcription(config, wait=wait)
+
+            if to_notion:
+                self.add_to_notion(config)
+        finally:
+            config.flush()
+
+    async def asynchronize(
+        self, config: Config, to_notion: bool = True, executor: Executor = None
+    ):
+        """Run the ETL pipeline as a coroutine.
+
+        The AWS and Notion SDKs are blocking, so each step runs on `executor`.
+        Waiting on the transcription job sleeps on the event loop instead, so
+        that many notes can be in flight without holding a thread each. Polling
+        stops as soon as the job leaves IN_PROGRESS, even if the transcript could
+        not be fetched, or after `config.max_polls` polls.
+        """
+        loop = asyncio.get_running_loop()
+
+        def run(f, *args, **kwargs):
+            return loop.run_in_executor(executor, functools.partial(f, *args, **kwargs))
+
+        await run(self.synchronize, config, to_notion=False, wait=False)
+
+        if self.status == VoiceNoteStatus.TranscriptionStarted:
+            job = TranscriptionJob.from_existing_job(config, self.transcription_job)
+            for delay in itertools.islice(poll_delays(config), config.max_polls):
+                await asyncio.sleep(delay)
+                description = await run(job.describe)
+                status = TranscriptionStatus(description["TranscriptionJobStatus"])
+                if status != TranscriptionStatus.IN_PROGRESS:
+                    await run(self.finalize_transcription, config)
+                    break
+            else:
+                logging.warning(
+                    "Gave up waiting on transcription job for %s.", self.name
+                )
+
+        if to_notion:
+            await run(self.add_to_notion, config)
 
     @bump_status(VoiceNoteStatus.Local)
     def cache_local(self, config: Config):
@@ -99,47 +174,152 @@ class VoiceNote:
             warnings.warn(
                 "File is already imported. Skipping and removing ingress file."
             )
-            os.remove(str((INGRESS_PATH / rel_path).absolute()))
+            os.remove(INGRESS_PATH / rel_path)
             return
 
-        shutil.move(self.path, new_path)
-        self.path = new_path
+        self._archive(config, new_path)
         return True
 
+    @bump_status(VoiceNoteStatus.S3)
+    def archive_and_upload(self, config: Config):
+        """Move the file into the archive and upload it to S3 together.
+
+        When the archive is on another filesystem, we upload from the ingress copy
+        while the file is copied, see `_archive`. The note is saved as `Local` as
+        soon as the file is archived, so that a failed upload is retried by
+        `upload_to_s3` later. Files which are already archived are left to `cache_local`.
+        """
+        if self.status != VoiceNoteStatus.Ingress:
+            return
+
+        rel_path = self.ingress_relative_path
+        assert rel_path is not None
+
+        new_path = ARCHIVE_PATH / rel_path
+        if new_path.exists():
+            self.cache_local(config)
+            return
+
+        uploaded = self._archive(
+            config, new_path, while_copying=functools.partial(self._upload, config)
+        )
+        if uploaded is None:
+            uploaded = self._upload(config, self.path)
+
+        return uploaded
+
+    def _archive(
+        self,
+        config: Config,
+        new_path: Path,
+        while_copying: Optional[Callable[[Path], Any]] = None,
+    ) -> Any:
+        """Move the file to `new_path` in the archive and save the note as `Local`.
+
+        Ingress and archive normally share a filesystem, making this a rename.
+        Otherwise the file is copied, and `while_copying` is run on the ingress file
+        in the meantime. Returns its result, or None if it was not run.
+        """
+        ingress_path = self.path
+        try:
+            os.replace(ingress_path, new_path)
+        except OSError:
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                pending = None
+                if while_copying is not None:
+                    pending = executor.submit(while_copying, ingress_path)
+
+                # copy under another name, so a failed copy is not taken as archived
+                partial_path = new_path.with_name(f"{new_path.name}.part")
+                shutil.copy2(ingress_path, partial_path)
+                os.replace(partial_path, new_path)
+                self._archived_as(config, new_path)
+
+                try:
+                    return pending.result() if pending is not None else None
+                finally:
+                    os.remove(ingress_path)
+
+        self._archived_as(config, new_path)
+        return None
+
+    def _archived_as(self, config: Config, path: Path):
+        self.path = path
+        del self.ingress_relative_path
+        self.status = VoiceNoteStatus.Local
+        config.save(self)
+
     @bump_status(VoiceNoteStatus.S3)
     def upload_to_s3(self, config: Config):
         """Ensure that the file is uploaded to S3 for retention."""
         if self.status != VoiceNoteStatus.Local:
             return
 
+        return self._upload(config, self.path)
+
+    def _upload(self, config: Config, path: Path) -> bool:
+        """Upload the file at `path`, reporting whether it succeeded."""
+        from boto3.exceptions import S3UploadFailedError
+        from botocore.exceptions import ClientError
+
         object_name = self.name
-        logging.info(f"Uploading file {self.path} as {object_name} to S3.")
+        bucket_name = config.bucket_name
+        logging.info("Uploading file %s as %s to S3.", path, object_name)
         try:
-            config.s3.meta.client.upload_file(
-                str(self.path.absolute()), config.voice_bucket.name, object_name
+            config.s3_client.upload_file(
+                os.fspath(path),
+                bucket_name,
+                object_name,
+                Config=config.s3_transfer_config,
             )
-        except ClientError as e:
+        except (ClientError, S3UploadFailedError) as e:
             logging.error(e)
+            return False
 
         return True
 
-    @bump_status(VoiceNoteStatus.Transcribed)
-    def transcribe_on_s3(self, config: Config):
-        """Run transcription for this media file on S3."""
+    @bump_status(VoiceNoteStatus.TranscriptionStarted)
+    def start_transcription(self, config: Config):
+        """Start a transcription job for this media file on S3."""
         if self.status != VoiceNoteStatus.S3:
             return
 
-        job_uri = f"s3://{config.voice_bucket.name}/{self.name}"
+        job_uri = f"s3://{config.bucket_name}/{self.name}"
 
-        logging.info(f"Running transcription job for {job_uri}")
+        logging.info("Running transcription job for %s", job_uri)
         job = TranscriptionJob(job_uri=job_uri, config=config)
         job.start()
 
-        transcript = job.block_on_transcript()
+        self.transcription_job = job.job_name
+        return True
+
+    @bump_status(VoiceNoteStatus.Transcribed)
+    def finalize_transcription(self, config: Config, wait=True):
+        """Retrieve the transcript from the job started by `start_transcription`.
+
+        Unless `wait` is set, this only checks in on the job and leaves it alone
+        if it is still running. Failed jobs send the note back to be transcribed again.
+        """
+        if self.status != VoiceNoteStatus.TranscriptionStarted:
+            return
+
+        job = TranscriptionJob.from_existing_job(config, self.transcription_job)
+        job.job_uri = f"s3://{config.bucket_name}/{self.name}"
+        if not wait and job.status == TranscriptionStatus.IN_PROGRESS:
+            return
+
+        try:
+            transcript = job.block_on_transcript()
+        except TranscriptionFailed:
+            self.status = VoiceNoteStatus.S3
+            self.transcription_job = None
+            config.save(self)
+            return
+
         if transcript is None:
             return
 
-        logging.info(f"Successfully retrieved transcript")
+        logging.info("Successfully retrieved transcript")
         self.transcript = transcript
         return True
 
@@ -165,64 +345,187 @@ class VoiceNote:
         assert self.status > VoiceNoteStatus.S3
 
         self.transcript = None
+        self.transcription_job = None
+        self.__dict__.pop("parsed_transcript", None)
         return True
 
-    def to_block(self, file=True):
-        """Convert this voice note to a Notion block object with S3 link."""
+    @functools.cached_property
+    def parsed_transcript(self) -> Transcript:
+        """Parse the transcript from AWS Transcribe, once per note.
+
+        `transcript` already holds the JSON decoded by `fetch_transcript`, which
+        uses `orjson` when it is installed, so no further decoding happens here.
+
+        Notion limits how many children a block can have, so very conversational
+        notes have their speakers concatenated.
+        """
         assert self.status >= VoiceNoteStatus.Transcribed
 
-        settings = FormattingSettings()
-        t = Transcript.from_aws_transcribe_json(
-            self.transcript["results"],
-            settings=settings,
-        )
+        results = self.transcript["results"]
+        t = Transcript.from_aws_transcribe_json(results, settings=DEFAULT_SETTINGS)
+        if Transcript.max_speaker_turns(results) <= 95:
+            return t
+
         if len(t.items_by_speaker()) > 95:
-            logging.warn("Concatenating speakers!")
-            settings = FormattingSettings(break_speakers=False)
-            t = Transcript.from_aws_transcribe_json(
-                self.transcript["results"],
-                settings=settings,
-            )
+            logging.warning("Concatenating speakers!")
+            t = Transcript.from_aws_transcribe_json(results, settings=CONCAT_SETTINGS)
 
-        block = t.to_block(RichText.bold(self.name))
+        return t
 
+    def to_blocks(self, file=True):
+        """Convert this voice note to Notion block objects with S3 link.
+
+        The first block is a header holding as much of the transcript as the API
+        allows, any remaining paragraphs follow it as separate blocks.
+        """
+        assert self.status >= VoiceNoteStatus.Transcribed
+
+        t = self.parsed_transcript
+
+        header_children = []
         if file:
-            Block.prepend_child(
-                block,
+            header_children.append(
                 Block.href(
                     f"{os.environ['AWS_SLUG']}{self.name}", f"AWS Console: {self.name}"
                 ),
             )
 
-        return block
+        header, chunks = t.to_block_chunks(
+            RichText.bold(self.name), header_children=header_children
+        )
+        return [header] + [paragraph for chunk in chunks for paragraph in chunk]
+
+    def safe_add_to_notion(self, config: Config):
+        """Log errors from adding the note to Notion."""
+        try:
+            self.add_to_notion(config)
+        except Exception as e:
+            logging.error("Unhandled exception: %s.", e)
+        finally:
+            config.flush()
 
     @bump_status(VoiceNoteStatus.Notion)
     def add_to_notion(self, config: Config):
         """Synchronize the voice note to the appropriate Notion planning page."""
-        if self.status >= VoiceNoteStatus.Notion:
+        if self.status != VoiceNoteStatus.Transcribed:
             return
 
         page_id = get_daily_page_id(config.notion_client, self.date)
 
         try:
-            block_children = self.to_block()
+            blocks = self.to_blocks()
         except NoSpeakersException:
             self.status = VoiceNoteStatus.Evicted
             config.save(self)
             return
 
-        config.notion_client.blocks.children.append(
-            block_id=page_id,
-            children=[block_children],
-        )
+        def record(sent: int):
+            self.notion_chunks_sent = sent
+            config.mark_dirty(self)
+
+        # appended in order, so any overflow paragraphs directly follow the header
+        with invalidate_on_missing_page(page_id):
+            Block.batch_append(
+                config.notion_client,
+                page_id,
+                blocks,
+                start=self.notion_chunks_sent,
+                progress=record,
+            )
 
         return True
 
-    @property
+    @functools.cached_property
     def date(self) -> datetime.datetime:
         """Determine the date for the voice note from the filename."""
         date = self.name.split("_")[0]
-        year = int(f"20{date[:2]}")
-        month = int(date[2:4])
-        day = int(date[4:])
-        return datetime.datetime(year=year, month=month, day=day, hour=12)
+        return datetime.datetime.strptime(date, "%y%m%d").replace(hour=12)
+
+
+def synchronize_batch(notes: List[VoiceNote], config: Config, max_workers: int = 8):
+    """Synchronize `notes` concurrently, adding them to Notion in the given order.
+
+    Every note runs through `VoiceNote.asynchronize` on one event loop, so all
+    transcription jobs are in flight together while blocking calls share
+    `max_workers` threads. Notes are added to Notion afterwards, in order, by
+    `add_batch_to_notion`.
+    All workers share the clients on `config`, which are created under a lock.
+    """
+
+    async def synchronize_all(executor: Executor):
+        coroutines = [
+            note.asynchronize(config, to_notion=False, executor=executor)
+            for note in notes
+        ]
+        for completed in tqdm(asyncio.as_completed(coroutines), total=len(notes)):
+            try:
+                await completed
+            except Exception as e:
+                logging.error("Unhandled exception: %s.", e)
+            finally:
+                config.flush()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        asyncio.run(synchronize_all(executor))
+
+    add_batch_to_notion(notes, config)
+
+
+def add_batch_to_notion(notes: List[VoiceNote], config: Config):
+    """Add transcribed `notes` to Notion in order, sharing requests between them.
+
+    Consecutive notes for the same daily page are appended in a single request when
+    they fit, see `Block.chunk_groups`. Each note is marked as synchronized once the
+    request holding its blocks succeeds. If a shared request fails, its notes are
+    retried one at a time, so that one bad note does not hold up the rest. Notes too
+    large for one request go through `VoiceNote.add_to_notion`, which resumes a
+    partially appended note instead of sending it again.
+    """
+    notes_by_page: Dict[str, List[VoiceNote]] = {}
+    blocks_by_page: Dict[str, List[List[Any]]] = {}
+    for note in notes:
+        if note.status != VoiceNoteStatus.Transcribed:
+            continue
+
+        try:
+            page_id = get_daily_page_id(config.notion_client, note.date)
+            blocks = note.to_blocks()
+        except NoSpeakersException:
+            note.status = VoiceNoteStatus.Evicted
+            config.mark_dirty(note)
+            continue
+        except Exception as e:
+            logging.error("Unhandled exception: %s.", e)
+            continue
+
+        notes_by_page.setdefault(page_id, []).append(note)
+        blocks_by_page.setdefault(page_id, []).append(blocks)
+
+    for page_id, page_notes in notes_by_page.items():
+        for indices, chunks in Block.chunk_groups(blocks_by_page[page_id]):
+            batch = [page_notes[i] for i in indices]
+            if len(chunks) > 1:
+                # too large to share, added on its own so a partial append can resume
+                batch[0].safe_add_to_notion(config)
+                continue
+
+            try:
+                with invalidate_on_missing_page(page_id):
+                    config.notion_client.blocks.children.append(
+                        block_id=page_id, children=chunks[0]
+                    )
+            except Exception as e:
+                logging.error("Unhandled exception: %s.", e)
+                if len(batch) > 1:
+                    for note in batch:
+                        note.safe_add_to_notion(config)
+
+                continue
+
+            for note in batch:
+                note.status = VoiceNoteStatus.Notion
+                config.mark_dirty(note)
+
+            config.flush()
+
+    config.flush()